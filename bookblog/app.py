@@ -1,11 +1,23 @@
 import os
 import io
-import json
+import re
+import hmac
+import atexit
 import uuid
+import hashlib
+import bisect
 import zipfile
+import shutil
+import tempfile
+import subprocess
 import datetime
+import threading
+import logging
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 import streamlit as st
 from PIL import Image
 
@@ -18,46 +30,353 @@ DATA_DIR = Path("data")
 COVERS_DIR = DATA_DIR / "covers"
 BOOKS_JSON = DATA_DIR / "books.json"
 COMMENTS_JSON = DATA_DIR / "comments.json"
+BOOKS_JSONL = DATA_DIR / "books.jsonl"
+COMMENTS_JSONL = DATA_DIR / "comments.jsonl"
+# Con BOOKBLOG_DURABLE=1, registro de cada snapshot guardado (archivo, sha256, tamaño)
+JOURNAL_JSONL = DATA_DIR / "journal.jsonl"
+
+# Archivos con un log append-only (.jsonl) de altas encima del snapshot JSON
+JSON_LOGS = {BOOKS_JSON: BOOKS_JSONL, COMMENTS_JSON: COMMENTS_JSONL}
+# Al pasar este tamaño el log se pliega en el snapshot
+COMPACT_LOG_BYTES = 1 << 20
+
+# BOOKBLOG_DURABLE=1 hace fsync de cada escritura (y del directorio tras renombrar),
+# verifica lo escrito antes de reemplazar y anota cada guardado en journal.jsonl.
+# Por defecto no: en desarrollo no hace falta y duplica la latencia de guardar.
+DURABLE = os.getenv("BOOKBLOG_DURABLE", "0") == "1"
+
+# Si está instalado, jpegoptim recomprime las portadas en segundo plano
+JPEGOPTIM = shutil.which("jpegoptim")
+JPEG_SAVE = {"format": "JPEG", "optimize": True, "progressive": True, "subsampling": "4:2:0"}
+
+# Miniatura que se muestra en la lista de libros
+THUMB_SIZE = (320, 320)
+COVER_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+# Separador entre libros en el texto de búsqueda concatenado
+SEARCH_SEP = "\x1f"
+
+PAGE_SIZE = 20
+
+logger = logging.getLogger(__name__)
 
 # =========================
 # Utilidades de almacenamiento
 # =========================
+@st.cache_resource
 def ensure_storage():
+    # Una vez por proceso: en cada rerun solo costaba syscalls. cache_resource y no
+    # functools.cache, que se recrea con el script en cada rerun.
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     COVERS_DIR.mkdir(parents=True, exist_ok=True)
     if not BOOKS_JSON.exists():
-        BOOKS_JSON.write_text(json.dumps([], ensure_ascii=False, indent=2), encoding="utf-8")
+        BOOKS_JSON.write_bytes(orjson.dumps([]))
     if not COMMENTS_JSON.exists():
-        COMMENTS_JSON.write_text(json.dumps([], ensure_ascii=False, indent=2), encoding="utf-8")
+        COMMENTS_JSON.write_bytes(orjson.dumps([]))
 
-def load_json(path: Path):
+def _now_iso() -> str:
+    # Mismo formato de siempre ("...Z"), sin el utcnow() obsoleto
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+def file_stamp(path: Path) -> tuple:
+    # El mtime solo no alcanza: dos escrituras seguidas pueden caer en el mismo
+    # tick del reloj del sistema de archivos. os.replace deja un inodo nuevo.
+    try:
+        info = os.stat(path)
+    except OSError:
+        return ()
+    return (info.st_mtime_ns, info.st_size, info.st_ino)
+
+def data_version(path: Path) -> tuple:
+    log = JSON_LOGS.get(path)
+    if log is None:
+        return (file_stamp(path),)
+    return (file_stamp(path), file_stamp(log))
+
+@st.cache_resource
+def _json_cache_state() -> tuple[dict, threading.Lock]:
+    # path -> (versión, lista parseada, vistas derivadas de esa versión).
+    # Streamlit vuelve a ejecutar el script en cada rerun, así que una variable global
+    # normal se recrearía vacía; cache_resource la deja una vez por proceso. Los reruns
+    # corren en hilos distintos, de ahí el lock.
+    return {}, threading.Lock()
+
+_json_cache, _json_cache_lock = _json_cache_state()
+
+@st.cache_resource
+def _write_locks_state() -> dict:
+    # Un escritor a la vez por archivo: compactar lee snapshot + log, guarda y borra el
+    # log, y un append en medio se perdería. Reentrante porque compact llama a save_json.
+    # Orden fijo: primero este lock y después _json_cache_lock, nunca al revés.
+    # Tiene que ser el mismo objeto para todos los reruns y sesiones del proceso.
+    return {path: threading.RLock() for path in JSON_LOGS}
+
+_write_locks = _write_locks_state()
+
+def _read_json_file(path: Path) -> list:
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        data = orjson.loads(path.read_bytes())
     except Exception:
+        data = []
+    log = JSON_LOGS.get(path)
+    if log is not None:
+        tail = load_jsonl(log)
+        if tail:
+            data = merge_lists_by_id(data, tail)
+    if path == BOOKS_JSON:
+        for b in data:
+            if "_search_blob_cf" not in b:
+                # Libros guardados antes de existir el campo (o con el antiguo en minúsculas).
+                # Se completa aquí, al parsear y bajo el lock de la caché: después la
+                # lista es compartida y el índice de búsqueda solo la lee.
+                b.pop("_search_blob", None)
+                b["_search_blob_cf"] = search_blob(b)
+    return data
+
+def _cache_entry(path: Path) -> tuple[tuple, list, dict]:
+    # save_json reemplaza el archivo y append_jsonl hace crecer el log, así que cada
+    # escritura cambia la versión y la entrada vieja deja de usarse sola.
+    version = data_version(path)
+    with _json_cache_lock:
+        entry = _json_cache.get(path)
+        if entry is None or entry[0] != version:
+            entry = (version, _read_json_file(path), {})
+            _json_cache[path] = entry
+        return entry
+
+def load_json(path: Path):
+    # Copia superficial: quien llama puede hacer append sin tocar la caché.
+    return list(_cache_entry(path)[1])
+
+def cached_view(path: Path, name: str, build):
+    """Estructura derivada de ``path`` (p. ej. un índice), una vez por versión.
+
+    Se comparte entre sesiones: no hay que modificarla.
+    """
+    _, data, views = _cache_entry(path)
+    if name not in views:
+        views[name] = build(data)
+    return views[name]
+
+def load_jsonl(path: Path) -> list:
+    try:
+        raw = path.read_bytes()
+    except OSError:
         return []
+    records = []
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            # Última línea a medio escribir (p. ej. un corte de luz): se ignora
+            continue
+    return records
+
+def _write_all(fd: int, payload: bytes):
+    view = memoryview(payload)
+    while view:
+        view = view[os.write(fd, view):]
+    if DURABLE:
+        os.fsync(fd)
+
+def _fsync_dir(path: Path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # p. ej. Windows, donde no se puede abrir un directorio
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def append_jsonl(path: Path, records: list):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        payload = b"".join(orjson.dumps(r) + b"\n" for r in records)
+        size = os.fstat(fd).st_size
+        if size:
+            os.lseek(fd, size - 1, os.SEEK_SET)
+            if os.read(fd, 1) != b"\n":
+                # Un append cortado a la mitad dejó la línea sin cerrar: sin este salto
+                # el primer registro nuevo quedaría pegado a ella y se descartaría con ella.
+                payload = b"\n" + payload
+        _write_all(fd, payload)
+    finally:
+        os.close(fd)
 
 def save_json(path: Path, data):
-    tmp = path.with_suffix(".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(path)
+    # orjson produce bytes UTF-8 directamente: una sola escritura, sin string intermedio.
+    payload = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    with _write_locks[path]:
+        # Nombre único + O_EXCL: dos guardados simultáneos nunca comparten temporal
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                _write_all(fd, payload)
+            finally:
+                os.close(fd)
+            if DURABLE:
+                # Se relee lo que quedó en disco antes de reemplazar el archivo bueno
+                digest = hashlib.sha256(payload).hexdigest()
+                if hashlib.sha256(tmp.read_bytes()).hexdigest() != digest:
+                    raise OSError(f"El contenido escrito en {tmp} no coincide")
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        # El snapshot ya incluye todo lo que había en el log: con el lock tomado
+        # nadie pudo agregar al log entre la lectura y este unlink.
+        log = JSON_LOGS.get(path)
+        if log is not None:
+            log.unlink(missing_ok=True)
+        if DURABLE:
+            _fsync_dir(path.parent)
+            append_jsonl(JOURNAL_JSONL, [{"path": path.name, "sha256": digest, "size": len(payload), "at": _now_iso()}])
+        # Lo recién escrito queda en la caché: el próximo load_json no vuelve a parsear
+        with _json_cache_lock:
+            _json_cache[path] = (data_version(path), list(data), {})
+
+def update_json(path: Path, fn):
+    """Lee, transforma con ``fn`` y guarda ``path`` sin perder appends concurrentes."""
+    with _write_locks[path]:
+        save_json(path, fn(load_json(path)))
+
+def compact(path: Path, min_bytes: int = 1):
+    log = JSON_LOGS.get(path)
+    if log is None:
+        return
+    with _write_locks[path]:
+        stamp = file_stamp(log)
+        if stamp and stamp[1] >= min_bytes:
+            save_json(path, load_json(path))
 
-def save_cover(uploaded_file) -> str | None:
+def append_records(path: Path, records: list):
+    # Bajo el lock de caché: si la caché tenía la versión de justo antes, se le suman
+    # los registros en memoria en lugar de volver a leer y parsear snapshot + log.
+    with _write_locks[path], _json_cache_lock:
+        before = data_version(path)
+        append_jsonl(JSON_LOGS[path], records)
+        entry = _json_cache.get(path)
+        if entry is not None and entry[0] == before:
+            # Las vistas (índices) se rehacen al pedirlas: son compartidas y no se tocan
+            _json_cache[path] = (data_version(path), merge_lists_by_id(entry[1], records), {})
+    compact(path, min_bytes=COMPACT_LOG_BYTES)
+
+def save_cover(uploaded_file) -> tuple[str, str]:
+    """Guarda la portada (máx. 1024 px) y una miniatura para las tarjetas."""
     if not uploaded_file:
-        return None
+        return "", ""
     ext = os.path.splitext(uploaded_file.name)[1].lower() or ".png"
-    filename = f"{uuid.uuid4().hex}{ext}"
-    out_path = COVERS_DIR / filename
-    image = Image.open(uploaded_file).convert("RGB")
-    image.thumbnail((1024, 1024))
+    out_path = COVERS_DIR / f"{uuid.uuid4().hex}{ext}"
+    thumb_path = thumb_path_for(out_path)
+    # formats= limita la detección a los tipos que acepta el uploader.
+    image = Image.open(uploaded_file, formats=("JPEG", "PNG"))
+    # En JPEG, libjpeg decodifica directo a 1/2, 1/4 u 1/8 de escala sin pasar por la
+    # resolución completa; en otros formatos no hace nada.
+    image.draft("RGB", (1024, 1024))
+    # El decode se hace aquí y no en el pool: un archivo dañado o truncado falla antes
+    # de guardar el libro. Solo el resize y la codificación van en segundo plano.
+    image.load()
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(out_path, format="JPEG", quality=85)
-    return str(out_path.as_posix())
+    _run_image_job(out_path, _encode_cover, image, out_path, thumb_path)
+    return str(out_path.as_posix()), str(thumb_path.as_posix())
+
+def _encode_cover(image, out_path: Path, thumb_path: Path):
+    if image.mode in ("1", "P"):
+        # Con paleta Pillow redimensiona con NEAREST: se pasa a color antes
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    # Resize en dos pasos: reducing_gap hace primero un reduce() por bloques hasta
+    # ~2x el tamaño final y solo ese último tramo usa LANCZOS.
+    image.thumbnail((1024, 1024), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    image = image.convert("RGB")
+    save_jpeg(image, out_path, quality=82)
+    save_thumb(image, thumb_path)
+    if JPEGOPTIM:
+        optimize_jpeg(out_path)
+        optimize_jpeg(thumb_path)
+
+def thumb_path_for(cover_path) -> Path:
+    p = Path(cover_path)
+    return p.with_name(f"{p.stem}_thumb.jpg")
+
+def save_thumb(image, thumb_path: Path):
+    # Mismo resize en dos pasos que la portada; se parte de la imagen ya reducida
+    thumb = image.copy()
+    thumb.thumbnail(THUMB_SIZE, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    save_jpeg(thumb, thumb_path, quality=78)
+
+def save_jpeg(image, path: Path, quality: int):
+    # A un temporal y después replace: nunca se sirve (ni se respalda) un JPEG a medias
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        image.save(tmp, quality=quality, **JPEG_SAVE)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def is_cover_file(name: str) -> bool:
+    # En covers/ también hay temporales (.tmp propios o de jpegoptim); no son portadas
+    return name.lower().endswith(COVER_SUFFIXES)
+
+def _encode_legacy_thumb(cover_path: str, thumb_path: Path):
+    with Image.open(cover_path) as image:
+        image.draft("RGB", THUMB_SIZE)
+        save_thumb(image.convert("RGB"), thumb_path)
+
+@st.cache_resource
+def _images_state() -> tuple[set, threading.Lock]:
+    # Imágenes que el pool todavía está generando, por ruta de salida. Como el pool,
+    # una vez por proceso: el rerun que pregunta no es el que encargó la imagen.
+    return set(), threading.Lock()
+
+_images_in_flight, _images_lock = _images_state()
+
+def _run_image_job(key: Path, fn, *args):
+    key = Path(key).as_posix()
+    with _images_lock:
+        if key in _images_in_flight:
+            return
+        _images_in_flight.add(key)
+
+    def work():
+        try:
+            fn(*args)
+        finally:
+            with _images_lock:
+                _images_in_flight.discard(key)
+
+    def report(future):
+        # Nadie espera el resultado: sin esto un error del pool se perdería en silencio
+        if future.exception() is not None:
+            logger.error("No se pudo generar %s", key, exc_info=future.exception())
+
+    background_pool().submit(work).add_done_callback(report)
+
+def image_pending(path) -> bool:
+    with _images_lock:
+        return Path(path).as_posix() in _images_in_flight
+
+def request_thumb(cover_path: str, thumb_path: Path):
+    """Genera en segundo plano la miniatura de una portada antigua."""
+    _run_image_job(thumb_path, _encode_legacy_thumb, cover_path, thumb_path)
+
+@st.cache_resource
+def background_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def optimize_jpeg(path: Path):
+    # jpegoptim escribe a un temporal y reemplaza: nunca se sirve un archivo a medias
+    subprocess.run([JPEGOPTIM, "--strip-all", "--max=85", "--quiet", str(path)],
+                   check=False, capture_output=True)
 
 # =========================
 # Lógica de dominio
 # =========================
-def add_book(title, author, year, tags, description, cover_path):
-    books = load_json(BOOKS_JSON)
+def add_book(title, author, year, tags, description, cover_path, thumb_path=""):
     book = {
         "id": uuid.uuid4().hex,
         "title": title.strip(),
@@ -66,108 +385,248 @@ def add_book(title, author, year, tags, description, cover_path):
         "tags": [t.strip() for t in tags.split(",")] if tags else [],
         "description": description.strip(),
         "cover_path": cover_path or "",
-        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "thumb_path": thumb_path or "",
+        "created_at": _now_iso(),
     }
-    books.append(book)
-    save_json(BOOKS_JSON, books)
+    book["_search_blob_cf"] = search_blob(book)
+    append_records(BOOKS_JSON, [book])
     return book
 
 def add_comment(book_id, user, text):
-    comments = load_json(COMMENTS_JSON)
     comment = {
         "id": uuid.uuid4().hex,
         "book_id": book_id,
         "user": (user or "Anónimo").strip(),
         "text": text.strip(),
-        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "created_at": _now_iso(),
     }
-    comments.append(comment)
-    save_json(COMMENTS_JSON, comments)
+    # Se escribe enseguida: agregar es un solo write con O_APPEND al log, y un comentario
+    # que solo viviera en la sesión se perdería al cerrar la pestaña.
+    append_records(COMMENTS_JSON, [comment])
     return comment
 
+def index_comments_by_book(comments):
+    d = {}
+    for c in comments:
+        d.setdefault(c.get("book_id"), []).append(c)
+    return d
+
+def comments_by_book():
+    return cached_view(COMMENTS_JSON, "by_book", index_comments_by_book)
+
 def get_comments(book_id):
-    comments = load_json(COMMENTS_JSON)
-    return [c for c in comments if c.get("book_id") == book_id]
+    return comments_by_book().get(book_id, [])
+
+def search_blob(b) -> str:
+    return " ".join(
+        [
+            b.get("title", ""),
+            b.get("author", ""),
+            b.get("year", ""),
+            " ".join(b.get("tags", [])),
+            b.get("description", ""),
+        ]
+    ).casefold()
 
 def search_books(q: str):
-    q = (q or "").lower().strip()
-    books = load_json(BOOKS_JSON)
+    # casefold en vez de lower: "strasse" encuentra "Straße"
+    return _search_index_books((q or "").casefold().strip())
+
+def _join_with_offsets(texts: list) -> tuple[str, list]:
+    offsets, pos = [], 0
+    for t in texts:
+        offsets.append(pos)
+        pos += len(t) + len(SEARCH_SEP)
+    return SEARCH_SEP.join(texts), offsets
+
+def find_in_corpus(corpus: str, offsets: list, q: str) -> list:
+    hits = []
+    pos = corpus.find(q)
+    while pos != -1:
+        i = bisect.bisect_right(offsets, pos) - 1
+        hits.append(i)
+        if i + 1 == len(offsets):
+            break
+        # Un acierto por libro: se sigue buscando desde el siguiente
+        pos = corpus.find(q, offsets[i + 1])
+    return hits
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text)
+
+def _build_search_index(books: list) -> tuple:
+    # Todos los textos de búsqueda en un solo string: una búsqueda es un par de
+    # str.find en C en vez de un bucle de Python por libro.
+    books = sorted(books, key=lambda b: b.get("created_at", ""), reverse=True)
+    corpus, offsets = _join_with_offsets([b["_search_blob_cf"] for b in books])
+    # Índice invertido palabra -> posiciones en la lista ordenada
+    posting = defaultdict(set)
+    for i, b in enumerate(books):
+        for t in tokenize(b["_search_blob_cf"]):
+            posting[t].add(i)
+    vocab = list(posting)
+    vocab_corpus, vocab_offsets = _join_with_offsets(vocab)
+    return books, corpus, offsets, posting, vocab, vocab_corpus, vocab_offsets
+
+def search_index() -> tuple:
+    # Compartido entre sesiones y reconstruido solo cuando cambia books.json
+    return cached_view(BOOKS_JSON, "search_index", _build_search_index)
+
+def _search_index_books(q: str) -> list:
+    # Sin st.cache_data: sobre el índice en memoria buscar cuesta menos que un acierto
+    # de caché (que serializa la respuesta), y la clave (q, versión) crecía sin límite.
+    books, corpus, offsets, posting, vocab, vocab_corpus, vocab_offsets = search_index()
     if not q:
-        return sorted(books, key=lambda b: b.get("created_at", ""), reverse=True)
-    res = []
-    for b in books:
-        haystack = " ".join(
-            [
-                b.get("title", ""),
-                b.get("author", ""),
-                b.get("year", ""),
-                " ".join(b.get("tags", [])),
-                b.get("description", ""),
-            ]
-        ).lower()
-        if q in haystack:
-            res.append(b)
-    return sorted(res, key=lambda b: b.get("created_at", ""), reverse=True)
+        return list(books)
+    if SEARCH_SEP in q:
+        return []
+    q_tokens = tokenize(q)
+    if not q_tokens:
+        return [books[i] for i in find_in_corpus(corpus, offsets, q)]
+    candidates = None
+    for t in q_tokens:
+        # La búsqueda es por substring: "pot" también debe encontrar "potter",
+        # así que se juntan las listas de todas las palabras que contienen t.
+        hits = set()
+        for j in find_in_corpus(vocab_corpus, vocab_offsets, t):
+            hits |= posting[vocab[j]]
+        candidates = hits if candidates is None else candidates & hits
+        if not candidates:
+            return []
+    return [books[i] for i in sorted(candidates) if q in books[i]["_search_blob_cf"]]
 
 # =========================
 # Exportación / Importación
 # =========================
-def export_json_bytes(path: Path) -> bytes:
-    data = load_json(path)
-    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+def export_json_bytes(path: Path, pretty: bool = False) -> bytes:
+    compact(path)
+    # Indentado solo para descargas que lee una persona; el backup va compacto
+    return orjson.dumps(load_json(path), option=orjson.OPT_INDENT_2 if pretty else 0)
 
 def merge_lists_by_id(old_list: list, new_list: list) -> list:
-    idx = {item.get("id"): i for i, item in enumerate(old_list) if item.get("id")}
-    for item in new_list:
-        _id = item.get("id")
-        if _id and _id in idx:
-            old_list[idx[_id]] = item
-        else:
-            old_list.append(item)
-    return old_list
+    # Un dict por id: al actualizar una clave existente se conserva su posición
+    merged = {item["id"]: item for item in old_list if item.get("id")}
+    merged.update({item["id"]: item for item in new_list if item.get("id")})
+    leftovers = [item for item in old_list if not item.get("id")]
+    leftovers += [item for item in new_list if not item.get("id")]
+    return list(merged.values()) + leftovers
 
 def import_json_bytes(path: Path, content: bytes, mode: str = "replace"):
-    incoming = json.loads(content.decode("utf-8"))
+    incoming = orjson.loads(content)
+    if path == BOOKS_JSON:
+        # Se recalcula siempre: el texto importado puede venir de otra versión o editado a mano
+        for b in incoming:
+            b.pop("_search_blob", None)
+            b["_search_blob_cf"] = search_blob(b)
     if mode == "replace":
         save_json(path, incoming)
     else:
-        current = load_json(path)
-        save_json(path, merge_lists_by_id(current, incoming))
+        update_json(path, lambda current: merge_lists_by_id(current, incoming))
 
-def make_backup_zip_bytes() -> bytes:
+@st.cache_resource
+def _backup_state() -> tuple[dict, threading.Lock]:
+    # El script se vuelve a ejecutar en cada rerun: el ZIP ya armado vive aquí, una vez
+    # por proceso, y se borra al salir.
+    state = {"signature": None, "path": None}
+    atexit.register(lambda: state["path"] and state["path"].unlink(missing_ok=True))
+    return state, threading.Lock()
+
+_backup, _backup_lock = _backup_state()
+
+def make_backup_zip_file() -> Path:
+    # Se arma al pedir la descarga y se reutiliza mientras no cambien los datos
     ensure_storage()
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+    compact(BOOKS_JSON)
+    compact(COMMENTS_JSON)
+    signature = (data_version(BOOKS_JSON), data_version(COMMENTS_JSON), file_stamp(COVERS_DIR))
+    with _backup_lock:
+        old = _backup["path"]
+        if _backup["signature"] == signature and old and old.exists():
+            return old
+        path = _write_backup_zip()
+        _backup.update(signature=signature, path=path)
+    if old:
+        try:
+            old.unlink(missing_ok=True)
+        except OSError:
+            pass
+    return path
+
+def _write_backup_zip() -> Path:
+    # Se escribe a disco: el ZIP completo (con portadas) no queda dos veces en RAM
+    with tempfile.NamedTemporaryFile(prefix="bookblog_backup_", suffix=".zip", delete=False) as f:
+        _fill_backup_zip(f)
+    return Path(f.name)
+
+def _fill_backup_zip(buf):
+    # Los JSON se comprimen rápido (nivel 1); las portadas ya son JPEG y se guardan tal cual
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as z:
         z.writestr("data/books.json", export_json_bytes(BOOKS_JSON))
         z.writestr("data/comments.json", export_json_bytes(COMMENTS_JSON))
         if COVERS_DIR.exists():
-            for p in COVERS_DIR.glob("*"):
-                if p.is_file():
-                    z.write(p, arcname=f"data/covers/{p.name}")
+            for p in COVERS_DIR.iterdir():
+                if is_cover_file(p.name):
+                    _add_cover_to_zip(z, p)
         manifest = {
             "version": 1,
-            "generated_at": datetime.datetime.utcnow().isoformat() + "Z",
+            "generated_at": _now_iso(),
             "notes": "Backup de BookBlog",
         }
-        z.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
-    buf.seek(0)
-    return buf.getvalue()
+        z.writestr("manifest.json", orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+def _add_cover_to_zip(z: zipfile.ZipFile, p: Path):
+    try:
+        src = open(p, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        return  # Borrada o reemplazada entre el listado y ahora
+    with src:
+        # Metadatos del archivo ya abierto, no de la ruta: aunque la renombren no falla
+        info = os.fstat(src.fileno())
+        zinfo = zipfile.ZipInfo(f"data/covers/{p.name}",
+                                date_time=datetime.datetime.fromtimestamp(info.st_mtime).timetuple()[:6])
+        zinfo.external_attr = (info.st_mode & 0xFFFF) << 16
+        zinfo.file_size = info.st_size
+        zinfo.compress_type = zipfile.ZIP_STORED
+        # Una sola pasada por archivo, en trozos de 1 MiB (z.write usa 8 KiB);
+        # el CRC se calcula sobre la marcha mientras se copia.
+        with z.open(zinfo, "w") as dst:
+            shutil.copyfileobj(src, dst, length=1 << 20)
+
+def _extract_cover(z: zipfile.ZipFile, info: zipfile.ZipInfo):
+    out = COVERS_DIR / Path(info.filename).name
+    # Restaurar dos veces el mismo backup no vuelve a copiar las portadas
+    if out.exists() and out.stat().st_size == info.file_size:
+        return
+    with z.open(info) as src, open(out, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1 << 20)
 
 def restore_from_zip_bytes(zip_bytes: bytes, mode: str = "replace"):
     ensure_storage()
     with zipfile.ZipFile(io.BytesIO(zip_bytes)) as z:
-        for name in z.namelist():
-            if name.startswith("data/covers/") and not name.endswith("/"):
-                out = COVERS_DIR / Path(name).name
-                out.parent.mkdir(parents=True, exist_ok=True)
-                with z.open(name) as src, open(out, "wb") as dst:
-                    dst.write(src.read())
-        if "data/books.json" in z.namelist():
-            books_bytes = z.read("data/books.json")
-            import_json_bytes(BOOKS_JSON, books_bytes, mode=mode)
-        if "data/comments.json" in z.namelist():
-            comments_bytes = z.read("data/comments.json")
-            import_json_bytes(COMMENTS_JSON, comments_bytes, mode=mode)
+        infos = z.infolist()
+        names = {info.filename for info in infos}
+        covers = [
+            info for info in infos
+            if info.filename.startswith("data/covers/") and is_cover_file(info.filename)
+        ]
+        if covers:
+            COVERS_DIR.mkdir(parents=True, exist_ok=True)
+            # Los handles de ZipFile no se comparten entre hilos, pero abrir uno por portada
+            # relee el directorio central cada vez: uno por hilo del pool y se reutiliza.
+            local = threading.local()
+
+            def extract(info):
+                if not hasattr(local, "zip"):
+                    local.zip = zipfile.ZipFile(io.BytesIO(zip_bytes))
+                _extract_cover(local.zip, info)
+
+            # list() espera a todas y hace que una excepción en un hilo llegue hasta aquí
+            list(background_pool().map(extract, covers))
+        for arcname, path in (("data/books.json", BOOKS_JSON), ("data/comments.json", COMMENTS_JSON)):
+            if arcname in names:
+                import_json_bytes(path, z.read(arcname), mode=mode)
 
 # =========================
 # Borrar todo
@@ -184,39 +643,69 @@ def delete_all_data():
 # =========================
 # UI
 # =========================
+def book_markdown(b) -> str:
+    meta = []
+    if b.get("author"):
+        meta.append(f"**Autor:** {b['author']}")
+    if b.get("year"):
+        meta.append(f"**Año:** {b['year']}")
+    if b.get("tags"):
+        meta.append("**Tags:** " + ", ".join(b["tags"]))
+    parts = [f"### {b.get('title', 'Sin título')}", "  •  ".join(meta) if meta else "_Sin detalles_"]
+    if b.get("description"):
+        parts.append(b["description"])
+    return "\n\n".join(parts)
+
+def render_comment(c):
+    st.markdown(f"**{c['user']}** — {c['created_at']}")
+    st.write(c["text"])
+    st.markdown("---")
+
+@st.fragment
 def book_card(b):
+    # Fragmento: escribir o enviar un comentario rerenderiza solo esta tarjeta.
+    # Los comentarios se leen aquí dentro para que un rerun del fragmento no use
+    # la lista que se le pasó en la última ejecución completa.
+    comments = get_comments(b["id"])
     col1, col2 = st.columns([1, 3])
     with col1:
-        if b.get("cover_path") and Path(b["cover_path"]).exists():
-            st.image(b["cover_path"], use_container_width=True)
+        cover = b.get("cover_path")
+        thumb = b.get("thumb_path")
+        if cover and Path(cover).exists():
+            if not thumb:
+                # Portada subida antes de existir las miniaturas: se genera una vez
+                thumb = thumb_path_for(cover).as_posix()
+                if not Path(thumb).exists():
+                    request_thumb(cover, Path(thumb))
+            if thumb and Path(thumb).exists():
+                st.image(thumb, width="stretch")
+                # La portada grande solo se envía al navegador si se pide
+                if st.toggle("🔍 Ampliar", key=f"full_{b['id']}"):
+                    st.image(cover, width="stretch")
+            else:
+                st.image(cover, width="stretch")
+        elif cover and image_pending(cover):
+            st.write("⏳ Procesando portada…")
         else:
             st.write("🖼️ Sin portada")
     with col2:
-        st.subheader(b.get("title", "Sin título"))
-        meta = []
-        if b.get("author"):
-            meta.append(f"**Autor:** {b['author']}")
-        if b.get("year"):
-            meta.append(f"**Año:** {b['year']}")
-        if b.get("tags"):
-            meta.append("**Tags:** " + ", ".join(b["tags"]))
-        st.markdown("  •  ".join(meta) if meta else "_Sin detalles_")
-        if b.get("description"):
-            st.markdown(b["description"])
+        # Título, datos y reseña van en un solo bloque de Markdown ya armado
+        st.markdown(book_markdown(b))
         with st.expander("💬 Comentarios"):
-            for c in get_comments(b["id"]):
-                st.markdown(f"**{c['user']}** — {c['created_at']}")
-                st.write(c["text"])
-                st.markdown("---")
+            for c in comments:
+                render_comment(c)
+            just_posted = st.container()
             with st.form(f"comment_form_{b['id']}"):
                 user = st.text_input("Tu nombre", key=f"name_{b['id']}")
                 text = st.text_area("Escribe un comentario", key=f"text_{b['id']}")
                 sent = st.form_submit_button("Publicar comentario")
                 if sent:
                     if text.strip():
-                        add_comment(b["id"], user, text)
+                        # Sin st.rerun(): el comentario nuevo solo cambia esta tarjeta,
+                        # así que se dibuja aquí y no se recalcula la página entera.
+                        with just_posted:
+                            render_comment(add_comment(b["id"], user, text))
                         st.success("Comentario publicado.")
-                        st.rerun()
                     else:
                         st.warning("El comentario no puede estar vacío.")
 
@@ -228,10 +717,14 @@ def main():
     st.sidebar.header("Buscar")
     q = st.sidebar.text_input("Título, autor, tag o descripción")
     st.sidebar.caption("Deja vacío para ver todo.")
+    results = search_books(q)
+    pages = max(1, -(-len(results) // PAGE_SIZE))
+    page = st.sidebar.number_input("Página", 1, pages, 1) if pages > 1 else 1
 
     st.sidebar.header("🔐 Admin")
     admin_key = st.sidebar.text_input("Clave de administrador", type="password")
-    is_admin = (admin_key == "7518")  # Cambia la clave aquí
+    # compare_digest tarda lo mismo sin importar dónde difieren: no filtra la clave por tiempos
+    is_admin = hmac.compare_digest(admin_key.encode("utf-8"), b"7518")  # Cambia la clave aquí
 
     # Tabs según permisos
     if is_admin:
@@ -241,12 +734,11 @@ def main():
 
     # Explorar
     with tab_list[0]:
-        results = search_books(q)
-        st.write(f"Resultados: **{len(results)}**")
+        st.write(f"Resultados: **{len(results)}**" + (f" · página {page} de {pages}" if pages > 1 else ""))
         if not results:
             st.info("Sin resultados.")
         else:
-            for b in results:
+            for b in results[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]:
                 st.divider()
                 book_card(b)
 
@@ -268,8 +760,8 @@ def main():
                 if not (title or "").strip():
                     st.error("El título es obligatorio.")
                 else:
-                    cover_path = save_cover(cover) if cover else ""
-                    book = add_book(title, author, year, tags, description, cover_path)
+                    cover_path, thumb_path = save_cover(cover) if cover else ("", "")
+                    book = add_book(title, author, year, tags, description, cover_path, thumb_path)
                     st.success(f"Libro agregado: {book['title']}")
                     st.rerun()
 
@@ -278,14 +770,15 @@ def main():
         with tab_list[2]:
             st.subheader("📤 Exportar")
             c1, c2, c3 = st.columns(3)
+            # Callables: compactar y serializar solo al hacer clic, no por ver el tab
             with c1:
-                st.download_button("books.json", data=export_json_bytes(BOOKS_JSON),
+                st.download_button("books.json", data=lambda: export_json_bytes(BOOKS_JSON, pretty=True),
                                    file_name="books.json", mime="application/json")
             with c2:
-                st.download_button("comments.json", data=export_json_bytes(COMMENTS_JSON),
+                st.download_button("comments.json", data=lambda: export_json_bytes(COMMENTS_JSON, pretty=True),
                                    file_name="comments.json", mime="application/json")
             with c3:
-                st.download_button("Backup completo (.zip)", data=make_backup_zip_bytes(),
+                st.download_button("Backup completo (.zip)", data=lambda: make_backup_zip_file().read_bytes(),
                                    file_name="bookblog_backup.zip", mime="application/zip")
 
             st.divider()